@@ -1,5 +1,11 @@
 #!/usr/bin/env python3
-import argparse, os, sys, subprocess, xml.etree.ElementTree as ET, hashlib, base64, shlex
+import argparse, os, sys, subprocess, xml.etree.ElementTree as ET, hashlib, base64, shlex, json
+from concurrent.futures import ThreadPoolExecutor
+
+# priv_hash is handled separately: gpg re-protects the key on every export, so only the
+# hash of the bytes --set actually uploaded is worth remembering
+CACHE_FIELDS = ('central_user', 'fpr', 'creds_hash', 'pass_hash', 'fpr_hash')
+KEYRING_FILES = ('pubring.kbx', os.path.join('public-keys.d', 'pubring.db'), 'pubring.gpg', 'secring.gpg', 'private-keys-v1.d')
 
 def die(msg):
     sys.stderr.write(msg+"\n"); sys.exit(1)
@@ -9,118 +15,240 @@ def which(cmd):
     return w(cmd)
 
 def run(cmd, input_bytes=None):
-    p = subprocess.Popen(cmd, stdin=subprocess.PIPE if input_bytes else None, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    out, err = p.communicate(input=input_bytes)
+    # CPython only takes the posix_spawn path (instead of fork+exec) for an absolute
+    # executable with close_fds=False; fds Python opens are non-inheritable (PEP 446)
+    p = subprocess.run(cmd, input=input_bytes, capture_output=True, close_fds=False)
     if p.returncode != 0:
-        raise RuntimeError("command failed: %s\n%s" % (" ".join(cmd), err.decode('utf-8','replace')))
-    return out
+        raise RuntimeError("command failed: %s\n%s" % (" ".join(cmd), p.stderr.decode('utf-8','replace')))
+    return p.stdout
 
-def sha256_str(s: str) -> str:
-    return hashlib.sha256(s.encode('utf-8')).hexdigest()
+def local(tag):
+    # strip any '{namespace}' prefix so settings.xml with an xmlns still matches
+    return tag.rsplit('}', 1)[-1]
 
-def main():
-    ap = argparse.ArgumentParser(description='Sync Central/GPG secrets from local ~/.m2/settings.xml and gpg to GitHub Actions secrets (hashed preview + optional set).')
-    ap.add_argument('--settings', default=os.path.expanduser('~/.m2/settings.xml'))
-    ap.add_argument('--repo', default=None, help='owner/repo for gh secret operations (defaults to current)')
-    ap.add_argument('--key-id', default=None, help='GPG key id/fingerprint to export; auto-detect if omitted')
-    ap.add_argument('--set', action='store_true', help='Write secrets to GitHub (CENTRAL_USERNAME, CENTRAL_PASSWORD, GPG_PASSPHRASE, GPG_PRIVATE_KEY, GPG_KEYNAME)')
-    ap.add_argument('--delete-first', action='store_true', help='Delete existing secrets before setting')
-    args = ap.parse_args()
+def children(elem):
+    return {local(c.tag): (c.text or '').strip() for c in elem}
 
-    if not os.path.exists(args.settings):
-        die('Settings not found: %s' % args.settings)
+def sha256_hex(*parts) -> str:
+    # feeds str/bytes parts in turn, so callers never concatenate or re-encode bytes
+    h = hashlib.sha256()
+    for p in parts:
+        h.update(p if isinstance(p, bytes) else p.encode('utf-8'))
+    return h.hexdigest()
+
+def mtime_ns(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
 
-    # Parse settings.xml
-    tree = ET.parse(args.settings)
-    root = tree.getroot()
+def cache_location(args):
+    # one file per (settings.xml, gpg home), so a changed key overwrites the entry rather
+    # than leaving old hashes behind. The key covers everything the preview is derived
+    # from: settings.xml and whichever keyring files this home actually uses (keybox,
+    # keyboxd, legacy pubring/secring)
+    gnupg = os.environ.get('GNUPGHOME') or os.path.expanduser('~/.gnupg')
+    stamps = []
+    for name in KEYRING_FILES:
+        mtime = mtime_ns(os.path.join(gnupg, name))
+        if mtime is not None:
+            stamps.append('%s=%d' % (name, mtime))
+    if not stamps:
+        # nothing to invalidate on, so never serve or store a cached preview
+        return None, None
+    settings = os.path.abspath(args.settings)
+    key = '%s:%s:%s' % (mtime_ns(args.settings), args.key_id or '', ','.join(stamps))
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(base, 'sync-central-secrets', sha256_hex(settings, b'\0', gnupg) + '.json'), key
+
+def load_cache(path, key):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(cached, dict) or cached.get('key') != key:
+        return None
+    if not all(isinstance(cached.get(k), str) for k in CACHE_FIELDS + ('priv_hash',)):
+        return None
+    return cached
+
+def save_cache(path, key, preview, priv_hash=None):
+    # only previews and hashes are stored, never the secret values themselves. Without a
+    # freshly uploaded priv_hash, keep the one --set stored for this same key
+    entry = dict({k: preview[k] for k in CACHE_FIELDS}, key=key)
+    if priv_hash is None:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+            if cached.get('key') == key and isinstance(cached.get('priv_hash'), str):
+                priv_hash = cached['priv_hash']
+        except (OSError, ValueError, AttributeError):
+            pass
+    if priv_hash is not None:
+        entry['priv_hash'] = priv_hash
+    try:
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(entry, f)
+    except OSError:
+        pass
+    prune_cache(os.path.dirname(path))
+
+def prune_cache(directory):
+    # drop entries written before the key was stored inside the file; each one was
+    # named after its mtimes and would otherwise keep an old credential hash forever
+    try:
+        with os.scandir(directory) as it:
+            for entry in it:
+                if not entry.name.endswith('.json'):
+                    continue
+                try:
+                    with open(entry.path, 'r', encoding='utf-8') as f:
+                        stale = 'key' not in json.load(f)
+                except (OSError, ValueError, TypeError):
+                    stale = True
+                if stale:
+                    os.remove(entry.path)
+    except OSError:
+        pass
 
-    ns = {}
-    # servers/server[id=central]
+def load_secrets(args):
+    # Stream settings.xml; only <server> and <properties> subtrees at the original
+    # ./servers/server and .//profiles/profile/properties paths are inspected
     central_user = central_pass = None
-    for srv in root.findall('./servers/server', ns):
-        sid = (srv.findtext('id') or '').strip()
-        if sid == 'central':
-            central_user = (srv.findtext('username') or '').strip()
-            central_pass = (srv.findtext('password') or '').strip()
-            break
+    passphrases = []
+    stack = []
+    for event, elem in ET.iterparse(args.settings, events=('start', 'end')):
+        if event == 'start':
+            stack.append(local(elem.tag))
+            continue
+        if len(stack) == 3 and stack[1:] == ['servers', 'server'] and central_user is None:
+            # servers/server[id=central]
+            fields = children(elem)
+            if fields.get('id') == 'central':
+                central_user = fields.get('username', '')
+                central_pass = fields.get('password', '')
+            elem.clear()
+        elif len(stack) >= 4 and stack[-3:] == ['profiles', 'profile', 'properties']:
+            # gpg.passphrase (unique)
+            val = children(elem).get('gpg.passphrase')
+            if val:
+                passphrases.append(val)
+            elem.clear()
+        stack.pop()
     if not central_user or not central_pass:
         die('Could not find <server id="central"> with username/password in %s' % args.settings)
 
-    # gpg.passphrase (unique)
-    passphrases = []
-    for prop in root.findall('.//profiles/profile/properties', ns):
-        val = prop.findtext('gpg.passphrase')
-        if val and val.strip():
-            passphrases.append(val.strip())
     uniq = sorted(set(passphrases))
     if len(uniq) != 1:
         die('Expected exactly one gpg.passphrase; found %d: %s' % (len(uniq), ','.join(uniq)))
     gpg_pass = uniq[0]
 
-    if not which('gpg'):
+    gpg = which('gpg')
+    if not gpg:
         die('gpg not found on PATH')
 
-    key_id = args.key_id
-    if not key_id:
-        # auto-detect signing-capable key (sec with s capability)
-        out = run(['gpg','--list-secret-keys','--with-colons']).decode('utf-8','replace').splitlines()
-        for line in out:
-            parts = line.split(':')
-            if len(parts) > 12 and parts[0] == 'sec' and 's' in parts[11]:
-                key_id = parts[4]
-                break
-        if not key_id:
-            die('No signing-capable secret key found (looked for sec with s capability)')
-
-    # fingerprint from key
-    fpr = None
-    out = run(['gpg','--with-colons','--list-secret-keys', key_id]).decode('utf-8','replace').splitlines()
+    # one colon-format listing yields both the signing key and its fingerprint;
+    # the fpr record immediately following a sec record belongs to that primary key
+    key_id = fpr = None
+    pending = False
+    out = run([gpg,'--with-colons','--fingerprint','--list-secret-keys'] + ([args.key_id] if args.key_id else [])).decode('utf-8','replace').splitlines()
     for line in out:
         parts = line.split(':')
-        if parts and parts[0] == 'fpr' and len(parts) > 9:
+        if parts[0] == 'sec':
+            # auto-detect signing-capable key (sec with s capability) unless one was given
+            pending = len(parts) > 12 and (args.key_id or 's' in parts[11])
+            if pending:
+                key_id = args.key_id or parts[4]
+        elif parts[0] == 'fpr' and pending and len(parts) > 9:
             fpr = parts[9]
             break
+        elif parts[0] == 'fpr':
+            pending = False
+    if not key_id:
+        die('No signing-capable secret key found (looked for sec with s capability)')
     if not fpr:
         die('Could not extract fingerprint for key %s' % key_id)
 
-    # export armored private key using loopback/passphrase; if agent rejects, fallback without pass
+    # export armored private key by the fingerprint resolved above; export-minimal drops
+    # third-party signatures to shrink the upload. If agent rejects loopback, fallback without pass
+    export = ['--export-options','export-minimal','--armor','--export-secret-keys', fpr]
     try:
-        armored = run(['gpg','--batch','--yes','--pinentry-mode','loopback','--passphrase', gpg_pass, '--armor','--export-secret-keys', key_id]).decode('utf-8','replace')
+        armored_bytes = run([gpg,'--batch','--yes','--pinentry-mode','loopback','--passphrase', gpg_pass] + export)
     except Exception:
-        armored = run(['gpg','--armor','--export-secret-keys', key_id]).decode('utf-8','replace')
+        armored_bytes = run([gpg] + export)
+
+    return central_user, central_pass, gpg_pass, fpr, armored_bytes
+
+def main():
+    ap = argparse.ArgumentParser(description='Sync Central/GPG secrets from local ~/.m2/settings.xml and gpg to GitHub Actions secrets (hashed preview + optional set).')
+    ap.add_argument('--settings', default=os.path.expanduser('~/.m2/settings.xml'))
+    ap.add_argument('--repo', default=None, help='owner/repo for gh secret operations (defaults to current)')
+    ap.add_argument('--key-id', default=None, help='GPG key id/fingerprint to export; auto-detect if omitted')
+    ap.add_argument('--set', action='store_true', help='Write secrets to GitHub (CENTRAL_USERNAME, CENTRAL_PASSWORD, GPG_PASSPHRASE, GPG_PRIVATE_KEY, GPG_KEYNAME)')
+    ap.add_argument('--delete-first', action='store_true', help='Delete existing secrets before setting')
+    ap.add_argument('--no-cache', action='store_true', help='Ignore the cached preview and re-read settings.xml and gpg')
+    args = ap.parse_args()
+
+    if not os.path.exists(args.settings):
+        die('Settings not found: %s' % args.settings)
 
-    # Hashes for comparison
-    creds_hash = sha256_str(central_user + ':' + central_pass)
-    pass_hash = sha256_str(gpg_pass)
-    fpr_hash = sha256_str(fpr)
-    priv_hash = hashlib.sha256(armored.encode('utf-8')).hexdigest()
+    path, key = cache_location(args)
+    # cache hits only serve the hashed preview, and only once --set has recorded the
+    # uploaded key's hash; --set always needs the real values
+    preview = None if args.set or args.no_cache or path is None else load_cache(path, key)
+    if preview is None:
+        central_user, central_pass, gpg_pass, fpr, armored_bytes = load_secrets(args)
+        # Hashes for comparison
+        preview = {
+            'central_user': central_user,
+            'fpr': fpr,
+            'creds_hash': sha256_hex(central_user, b':', central_pass),
+            'pass_hash': sha256_hex(gpg_pass),
+            'fpr_hash': sha256_hex(fpr),
+            'priv_hash': sha256_hex(armored_bytes),
+        }
+        if path is not None and not args.set:
+            save_cache(path, key, preview)
 
-    print('Central user: %s' % central_user)
-    print('Key fingerprint: %s' % fpr)
-    print('SHA256 central(user:pass): %s' % creds_hash)
-    print('SHA256 gpg.passphrase: %s' % pass_hash)
-    print('SHA256 gpg.keyname(fingerprint): %s' % fpr_hash)
-    print('SHA256 armored private key: %s' % priv_hash)
+    print('Central user: %s' % preview['central_user'])
+    print('Key fingerprint: %s' % preview['fpr'])
+    print('SHA256 central(user:pass): %s' % preview['creds_hash'])
+    print('SHA256 gpg.passphrase: %s' % preview['pass_hash'])
+    print('SHA256 gpg.keyname(fingerprint): %s' % preview['fpr_hash'])
+    print('SHA256 armored private key: %s' % preview['priv_hash'])
 
     if args.set:
         if not which('gh'):
             die('gh not found on PATH (needed for --set)')
         repo_flag = ['--repo', args.repo] if args.repo else []
-        if args.delete_first:
-            for name in ['CENTRAL_USERNAME','CENTRAL_PASSWORD','GPG_PASSPHRASE','GPG_PRIVATE_KEY','GPG_KEYNAME']:
-                subprocess.run(['gh','secret','delete',name,'--app','actions'] + repo_flag, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        # set secrets
-        for name, value in [
+        secrets = [
             ('CENTRAL_USERNAME', central_user),
             ('CENTRAL_PASSWORD', central_pass),
             ('GPG_PASSPHRASE', gpg_pass),
-            ('GPG_PRIVATE_KEY', armored),
+            ('GPG_PRIVATE_KEY', armored_bytes),
             ('GPG_KEYNAME', fpr),
-        ]:
+        ]
+        # each gh call is an independent API round-trip, so issue them concurrently
+        def delete_secret(name):
+            subprocess.run(['gh','secret','delete',name,'--app','actions'] + repo_flag, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        def set_secret(item):
+            name, value = item
             proc = subprocess.Popen(['gh','secret','set',name,'--app','actions'] + repo_flag, stdin=subprocess.PIPE)
-            proc.communicate(input=value.encode('utf-8'))
-            if proc.returncode != 0:
-                die('failed to set secret %s' % name)
+            # the armored key is piped as gpg produced it, without a decode/encode copy
+            proc.communicate(input=value if isinstance(value, bytes) else value.encode('utf-8'))
+            return name, proc.returncode
+        with ThreadPoolExecutor(max_workers=len(secrets)) as pool:
+            if args.delete_first:
+                list(pool.map(delete_secret, [name for name, _ in secrets]))
+            failed = [name for name, rc in pool.map(set_secret, secrets) if rc != 0]
+        if failed:
+            die('failed to set secret %s' % ', '.join(failed))
+        if path is not None:
+            # priv_hash was computed from armored_bytes, the exact bytes piped to gh
+            save_cache(path, key, preview, priv_hash=preview['priv_hash'])
         print('Secrets updated in GitHub (Actions app).')
 
 if __name__ == '__main__':
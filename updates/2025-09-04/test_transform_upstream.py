@@ -0,0 +1,57 @@
+import os, sys, re, random, unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from transform_upstream import transform
+
+def reference_transform(text, name):
+    # the original one-re.sub-per-rewrite version; transform() must match it exactly
+    text = re.sub(r'^package\s+jdk\.internal\.util\.json;', 'package jdk.sandbox.internal.util.json;', text, flags=re.M)
+    text = re.sub(r'^(\s*import\s+)java\.util\.json\.', r'\1jdk.sandbox.java.util.json.', text, flags=re.M)
+    text = re.sub(r'^\s*@(?:jdk\.internal\..*|ValueBased|StableValue).*\n', '', text, flags=re.M)
+    text = re.sub(r'^\s*import\s+jdk\.internal\.ValueBased;\s*\n', '', text, flags=re.M)
+    text = re.sub(r'\bimplements\s+JsonValueImpl\s*,\s*', 'implements ', text)
+    text = re.sub(r'\bimplements\s+([^\{\n]*)\bJsonValueImpl\s*(,\s*)', lambda m: 'implements '+m.group(1), text)
+    text = re.sub(r'\bimplements\s+JsonValueImpl\b\s*', '', text)
+    text = re.sub(r'^\s*import\s+.*JsonValueImpl;\s*\n', '', text, flags=re.M)
+    text = re.sub(r'catch\s*\(([^\)]*)_\)', r'catch(\1e)', text)
+    text = re.sub(r'case\s+([A-Za-z0-9_$.<>\[\]]+)\s+_\s*->', r'case \1 v ->', text)
+    return text
+
+CASES = [
+    # the annotation removal lets the ValueBased import swallow the blank lines after it
+    'package jdk.internal.util.json;\n\nimport jdk.internal.ValueBased;\n@ValueBased\n\npublic final class X {}\n',
+    # a bare implements JsonValueImpl eats the next line's indent; the import is rewritten first
+    '    final class X implements JsonValueImpl\n    import java.util.json.JsonValue;\n',
+    # the middle-position rewrite must not start at an earlier implements across a newline
+    'implements   \n \t(final class A implements JsonValueImpl, JsonString {\n',
+    'package jdk.internal.util.json;\n\nimport java.util.json.JsonValue;\nimport jdk.internal.util.json.JsonValueImpl;\n'
+    '\n@jdk.internal.vm.annotation.Stable\nfinal class A implements JsonValueImpl, JsonObject {\n'
+    '    void m() { try {} catch (Exception _) {} switch (v) { case JsonString _ -> 1; default -> 0; } }\n}\n',
+    'package jdk.sandbox.internal.util.json;\n\nimport jdk.sandbox.java.util.json.JsonValue;\n',
+]
+
+# fragments for random inputs; they exercise how the rewrites interact at their edges
+TOKENS = ['package jdk.internal.util.json;', 'import ', 'import java.util.json.', 'JsonValue;',
+          'import jdk.internal.ValueBased;', 'import a.JsonValueImpl;', '@ValueBased', '@StableValue',
+          '@jdk.internal.vm.Stable', '@Override', 'implements ', 'JsonValueImpl', ', ', ',', ' ', '\t',
+          '\n', '\n\n', '{', '}', '(', ')', 'catch (', 'case ', '_', ' _ ->', '->', 'X', 'Foo.Bar<A>']
+
+class TransformTest(unittest.TestCase):
+
+    def test_matches_reference(self):
+        for text in CASES:
+            with self.subTest(text=text):
+                self.assertEqual(reference_transform(text, 'X.java'), transform(text, 'X.java'))
+
+    def test_matches_reference_on_random_input(self):
+        rnd = random.Random(0)
+        for _ in range(20000):
+            text = ''.join(rnd.choice(TOKENS) for _ in range(rnd.randint(1, 14)))
+            self.assertEqual(reference_transform(text, 'X.java'), transform(text, 'X.java'), repr(text))
+
+    def test_rewrites_import_after_bare_implements(self):
+        out = transform(CASES[1], 'X.java')
+        self.assertIn('import jdk.sandbox.java.util.json.JsonValue;', out)
+
+if __name__ == '__main__':
+    unittest.main()
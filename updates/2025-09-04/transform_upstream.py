@@ -1,51 +1,88 @@
 import os, sys, re, shutil
+from concurrent.futures import ProcessPoolExecutor
 
 SRC = 'updates/2025-09-04/upstream/jdk.internal.util.json'
 DST = 'json-java21/src/main/java/jdk/sandbox/internal/util/json'
+# below this many files the transform runs in-process
+_POOL_MIN_FILES = 200
+
+# the package line is a fixed literal at the start of a line, so str.replace handles it
+_PKG_OLD = 'package jdk.internal.util.json;'
+_PKG_NEW = 'package jdk.sandbox.internal.util.json;'
+
+# (needles, pattern, replacement) in application order. The order matters: removals
+# consume surrounding whitespace and so change what later anchors see, which is why
+# these cannot be fused into one alternation. A pass only runs when its text contains
+# one of the needles, a literal every match of the pattern must include.
+_PASSES = (
+    # imports for public API
+    (('java.util.json.',), re.compile(r'^(\s*import\s+)java\.util\.json\.', re.M), r'\1jdk.sandbox.java.util.json.'),
+    # annotations (single-line)
+    (('@jdk.internal.', '@ValueBased', '@StableValue'),
+     re.compile(r'^\s*@(?:jdk\.internal\..*|ValueBased|StableValue).*\n', re.M), ''),
+    # remove import of ValueBased if present
+    (('jdk.internal.ValueBased;',), re.compile(r'^\s*import\s+jdk\.internal\.ValueBased;\s*\n', re.M), ''),
+    # remove JsonValueImpl from implements if present: first, then middle, then alone.
+    # Kept as three passes; as one alternation the middle branch could start at an
+    # earlier 'implements' before the first-position rewrite had run over the file
+    (('JsonValueImpl',), re.compile(r'\bimplements\s+JsonValueImpl\s*,\s*'), 'implements '),
+    (('JsonValueImpl',), re.compile(r'\bimplements\s+([^\{\n]*)\bJsonValueImpl\s*,\s*'), r'implements \1'),
+    (('JsonValueImpl',), re.compile(r'\bimplements\s+JsonValueImpl\b\s*'), ''),
+    # remove stray imports of JsonValueImpl
+    (('JsonValueImpl;',), re.compile(r'^\s*import\s+.*JsonValueImpl;\s*\n', re.M), ''),
+    # Java 22+ patterns: unnamed variables '_' → name them
+    (('_)',), re.compile(r'catch\s*\(([^\)]*)_\)'), r'catch(\1e)'),
+    (('->',), re.compile(r'case\s+([A-Za-z0-9_$.<>\[\]]+)\s+_\s*->'), r'case \1 v ->'),
+)
+
+# literals at least one of which every _PASSES match contains; the unnamed-variable
+# forms and the import rewrite need whitespace-tolerant or counting checks instead
+_MARKERS = ('JsonValueImpl', 'ValueBased', '@jdk.internal.', '@StableValue')
+_UNNAMED_HINT_RE = re.compile(r'_(?:\s*->|\))')
 
 def read(path):
-    f = open(path, 'r')
-    try:
+    with open(path, 'r', encoding='utf-8') as f:
         return f.read()
-    finally:
-        f.close()
 
 def write_safe(path, text):
-    tmp = path + '.tmp'
-    f = open(tmp, 'w')
-    try:
-        f.write(text)
-    finally:
-        f.close()
-    if os.path.getsize(tmp) == 0:
+    # check the size before touching disk; os.replace swaps the file in atomically
+    data = text.encode('utf-8')
+    if not data:
         sys.stderr.write('Refusing to overwrite 0-byte: '+path+'\n')
-        os.remove(tmp)
         return False
-    if os.path.exists(path):
-        os.remove(path)
-    os.rename(tmp, path)
+    # leave identical files untouched so re-runs don't bump mtimes and trigger rebuilds
+    try:
+        with open(path, 'rb') as f:
+            if f.read() == data:
+                return True
+    except FileNotFoundError:
+        pass
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
     return True
 
 def transform(text, name):
-    # package
-    text = re.sub(r'^package\s+jdk\.internal\.util\.json;', 'package jdk.sandbox.internal.util.json;', text, flags=re.M)
-    # imports for public API
-    text = re.sub(r'^(\s*import\s+)java\.util\.json\.', r'\1jdk.sandbox.java.util.json.', text, flags=re.M)
-    # annotations (single-line)
-    text = re.sub(r'^\s*@(?:jdk\.internal\..*|ValueBased|StableValue).*\n', '', text, flags=re.M)
-    # remove import of ValueBased if present
-    text = re.sub(r'^\s*import\s+jdk\.internal\.ValueBased;\s*\n', '', text, flags=re.M)
-    # remove JsonValueImpl from implements if present
-    text = re.sub(r'\bimplements\s+JsonValueImpl\s*,\s*', 'implements ', text)
-    text = re.sub(r'\bimplements\s+([^\{\n]*)\bJsonValueImpl\s*(,\s*)', lambda m: 'implements '+m.group(1), text)
-    text = re.sub(r'\bimplements\s+JsonValueImpl\b\s*', '', text)
-    # remove stray imports of JsonValueImpl
-    text = re.sub(r'^\s*import\s+.*JsonValueImpl;\s*\n', '', text, flags=re.M)
-    # Java 22+ patterns: unnamed variables '_' → name them
-    text = re.sub(r'catch\s*\(([^\)]*)_\)', r'catch(\1e)', text)
-    text = re.sub(r'case\s+([A-Za-z0-9_$.<>\[\]]+)\s+_\s*->', r'case \1 v ->', text)
+    if text.startswith(_PKG_OLD):
+        text = _PKG_NEW + text[len(_PKG_OLD):]
+    text = text.replace('\n'+_PKG_OLD, '\n'+_PKG_NEW)
+    # already-transformed files (every java.util.json. is the sandbox one) skip the regex passes
+    if (not any(m in text for m in _MARKERS)
+            and text.count('java.util.json.') == text.count('sandbox.java.util.json.')
+            and not _UNNAMED_HINT_RE.search(text)):
+        return text
+    for needles, pattern, repl in _PASSES:
+        if any(n in text for n in needles):
+            text = pattern.sub(repl, text)
     return text
 
+def _one(job):
+    src_path, dst_path, name = job
+    data = read(src_path)
+    out = transform(data, name)
+    return write_safe(dst_path, out)
+
 def main():
     if not os.path.isdir(SRC):
         sys.stderr.write('Missing SRC: '+SRC+'\n')
@@ -53,19 +90,23 @@ def main():
     if not os.path.isdir(DST):
         sys.stderr.write('Missing DST: '+DST+'\n')
         sys.exit(1)
-    ok = True
-    for name in os.listdir(SRC):
-        if not name.endswith('.java'):
-            continue
-        if name in ('StableValue.java', 'Utils.java'):
-            # Keep local backport helper and existing Utils for now
-            continue
-        src_path = os.path.join(SRC, name)
-        dst_path = os.path.join(DST, name)
-        data = read(src_path)
-        out = transform(data, name)
-        if not write_safe(dst_path, out):
-            ok = False
+    jobs = []
+    with os.scandir(SRC) as it:
+        for entry in it:
+            if not entry.name.endswith('.java') or not entry.is_file():
+                continue
+            if entry.name in ('StableValue.java', 'Utils.java'):
+                # Keep local backport helper and existing Utils for now
+                continue
+            jobs.append((entry.path, os.path.join(DST, entry.name), entry.name))
+    workers = min(len(jobs), os.cpu_count() or 1)
+    if len(jobs) < _POOL_MIN_FILES or workers < 2:
+        # a file costs well under a millisecond; pool startup would dominate
+        ok = all([_one(job) for job in jobs])
+    else:
+        # regex rewriting is pure-Python CPU work, so spread large trees across processes
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            ok = all(list(pool.map(_one, jobs, chunksize=-(-len(jobs) // workers))))
     if not ok:
         sys.exit(2)
     print('Transform complete')